@@ -2,21 +2,22 @@
 from __future__ import annotations
 
 import os
+import re
 import time
+from bisect import bisect_right
 from pathlib import Path
 from sqlite3 import Connection
 from typing import Any, Dict, List
 
 from dotenv import load_dotenv
-from flask import Flask, jsonify, render_template_string, request
+from flask import Flask, jsonify, request
+from jinja2 import Template
 
 from db import get_db, init_db
+from services import latest_sighting
 
 load_dotenv()
 
-APP_ENV = os.getenv("APP_ENV", "production")
-HOST = os.getenv("HOST", "0.0.0.0")
-PORT = int(os.getenv("PORT", "8000"))
 SECRET_KEY = os.getenv("SECRET_KEY", "dev")
 SQLITE_PATH = os.getenv("SQLITE_PATH", "./data/app.db")
 AD_TEMPLATE_PATH = os.getenv("AD_TEMPLATE_PATH", "./templates/ad.html")
@@ -75,14 +76,51 @@ _DEFAULT_AD_TEMPLATE = """
 </html>
 """
 
+# Compiled ad templates keyed by (path, mtime, variant); Flask does not cache
+# string templates, so compiling once saves the Jinja lex/parse step on every
+# /ad hit. The "empty" variant has the purchases loop stripped out, so pages
+# with no purchase history skip the loop machinery entirely.
+_tpl_cache: Dict[tuple, Template] = {}
+
+_PURCHASES_LOOP_RE = re.compile(
+    r"{%-?\s*for\s+\w+\s+in\s+purchases\s*-?%}.*?{%-?\s*endfor\s*-?%}",
+    re.DOTALL,
+)
+
+
+def _get_ad_template(empty: bool = False) -> Template:
+    """Return the compiled ad template, recompiling only when the file changes."""
+    path = Path(AD_TEMPLATE_PATH)
+    try:
+        key = (str(path), path.stat().st_mtime, empty)
+        source = None
+    except OSError:
+        key = ("<default>", 0.0, empty)
+        source = _DEFAULT_AD_TEMPLATE
+
+    template = _tpl_cache.get(key)
+    if template is None:
+        if source is None:
+            source = path.read_text(encoding="utf-8")
+        if empty:
+            source = _PURCHASES_LOOP_RE.sub("", source)
+        template = app.jinja_env.from_string(source)
+        if len(_tpl_cache) > 4:
+            _tpl_cache.clear()
+        _tpl_cache[key] = template
+    return template
+
+
+# Unit table for _format_elapsed: bisect picks the bucket, the matching
+# divisor/suffix pair formats it without a chain of comparisons.
+_EDGES = (60, 3600, 86400)
+_DIVISORS = (1, 60, 3600, 86400)
+_SUFFIXES = ("s", "m", "h", "d")
+
+
 def _format_elapsed(seconds: int) -> str:
-    if seconds < 60:
-        return f"{seconds}s"
-    if seconds < 3600:
-        return f"{seconds // 60}m"
-    if seconds < 86400:
-        return f"{seconds // 3600}h"
-    return f"{seconds // 86400}d"
+    i = bisect_right(_EDGES, seconds)
+    return f"{seconds // _DIVISORS[i]}{_SUFFIXES[i]}"
 
 def render_ad(member_id: str, conn: Connection):
     """Render the HTML advertisement for ``member_id``."""
@@ -91,8 +129,18 @@ def render_ad(member_id: str, conn: Connection):
         "SELECT ts, sku, amount FROM purchases WHERE id=? ORDER BY ts DESC LIMIT 5",
         (member_id,),
     )
+    rows = cur.fetchall()
+    headline = f"會員 {member_id[:8]}，歡迎回來！"
+
+    if not rows:
+        return _get_ad_template(empty=True).render(
+            member_id=member_id,
+            purchases=purchases,
+            headline=headline,
+        )
+
     now = int(time.time())
-    for ts, sku, amount in cur.fetchall():
+    for ts, sku, amount in rows:
         delta = max(0, now - int(ts))
         purchases.append(
             {
@@ -102,31 +150,25 @@ def render_ad(member_id: str, conn: Connection):
             }
         )
 
-    headline = f"會員 {member_id[:8]}，歡迎回來！"
-
-    path = Path(AD_TEMPLATE_PATH)
-    template_source = (
-        path.read_text(encoding="utf-8") if path.exists() else _DEFAULT_AD_TEMPLATE
-    )
-    return render_template_string(
-        template_source,
+    return _get_ad_template().render(
         member_id=member_id,
         purchases=purchases,
         headline=headline,
     )
 
-@app.before_first_request
 def ensure_database():
     Path(SQLITE_PATH).parent.mkdir(parents=True, exist_ok=True)
     init_db(SQLITE_PATH)
 
+# Run at import time so the schema exists before gunicorn serves the first
+# request (before_first_request no longer exists in Flask 3).
+ensure_database()
+
 @app.route("/health")
 def health():
     return jsonify({"ok": True})
 
-@app.route("/")
-def index():
-    return """
+_INDEX_TEMPLATE = """
 <!doctype html>
 <html><head><meta charset='utf-8'><meta name='viewport' content='width=device-width,initial-scale=1'>
 <title>Display</title></head>
@@ -136,7 +178,7 @@ def index():
 const delay = {delay};
 async function tick(){
   try{
-    const r = await fetch('/latest', {{credentials:'include'}});
+    const r = await fetch('/latest', {credentials:'include'});
     const j = await r.json();
     if(j && j.member_id){ location.href = '/ad?member_id=' + encodeURIComponent(j.member_id); return; }
   }catch(e){}
@@ -145,14 +187,37 @@ async function tick(){
 setTimeout(tick, delay);
 </script>
 </body></html>
-""".format(delay=PUSH_DELAY_MS)
+"""
+
+def _write_index_html() -> None:
+    """Materialise the display page with PUSH_DELAY_MS substituted once, so
+    ``/`` is served as a static file instead of re-building the string per
+    request."""
+    html = _INDEX_TEMPLATE.replace("{delay}", str(PUSH_DELAY_MS))
+    path = Path(app.static_folder) / "index.html"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if not path.exists() or path.read_text(encoding="utf-8") != html:
+        path.write_text(html, encoding="utf-8")
+
+_write_index_html()
+
+@app.route("/")
+def index():
+    return app.send_static_file("index.html")
 
 @app.route("/latest")
 def latest():
-    conn = get_db(SQLITE_PATH)
-    cur = conn.execute("SELECT id FROM members ORDER BY last_seen_ts DESC LIMIT 1")
-    row = cur.fetchone()
-    return jsonify({"member_id": row[0] if row else None})
+    # The camera publishes the newest sighting to tmpfs; reading that file is
+    # far cheaper than a SQLite query for this constantly-polled endpoint.
+    member_id = latest_sighting.read()
+    if member_id is None:
+        conn = get_db(SQLITE_PATH)
+        cur = conn.execute(
+            "SELECT id FROM members ORDER BY last_seen_ts DESC LIMIT 1"
+        )
+        row = cur.fetchone()
+        member_id = row[0] if row else None
+    return jsonify({"member_id": member_id})
 
 @app.route("/ad")
 def ad():
@@ -161,6 +226,3 @@ def ad():
         return jsonify({"error": "missing member_id"}), 400
     conn = get_db(SQLITE_PATH)
     return render_ad(member_id, conn)
-
-if __name__ == "__main__":
-    app.run(host=HOST, port=PORT, debug=(APP_ENV != "production"))
@@ -3,6 +3,7 @@ from __future__ import annotations
 
 import random
 import sqlite3
+import threading
 import time
 
 SCHEMA = """
@@ -19,7 +20,7 @@ CREATE TABLE IF NOT EXISTS purchases (
   sku TEXT NOT NULL,
   amount INTEGER NOT NULL
 );
-CREATE INDEX IF NOT EXISTS idx_purchases_id ON purchases(id);
+CREATE INDEX IF NOT EXISTS idx_purchases_id_ts ON purchases(id, ts DESC);
 """
 
 _SKUS = [
@@ -33,16 +34,31 @@ _SKUS = [
     "雞蛋",
 ]
 
-_connections: dict[str, sqlite3.Connection] = {}
+# One connection per thread: a single shared connection serializes all
+# readers under a threaded WSGI server, and SQLite objects are cheap to open
+# against a warm page cache.
+_local = threading.local()
+
+_PRAGMAS = (
+    "PRAGMA journal_mode=WAL;",
+    "PRAGMA synchronous=NORMAL;",
+    "PRAGMA temp_store=MEMORY;",
+    "PRAGMA mmap_size=268435456;",
+    "PRAGMA cache_size=-20000;",
+)
 
 def get_db(path: str) -> sqlite3.Connection:
-    """Return a cached SQLite connection for ``path``."""
-    conn = _connections.get(path)
+    """Return the calling thread's cached SQLite connection for ``path``."""
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get(path)
     if conn is None:
-        conn = sqlite3.connect(path, check_same_thread=False)
+        conn = sqlite3.connect(path)
         conn.row_factory = sqlite3.Row
-        conn.execute("PRAGMA journal_mode=WAL;")
-        _connections[path] = conn
+        for pragma in _PRAGMAS:
+            conn.execute(pragma)
+        connections[path] = conn
     return conn
 
 def init_db(path: str) -> None:
@@ -51,30 +67,40 @@ def init_db(path: str) -> None:
     conn.executescript(SCHEMA)
     conn.commit()
 
+_UPSERT_MEMBER_SQL = (
+    "INSERT INTO members(id, first_seen_ts, last_seen_ts) VALUES(?,?,?) "
+    "ON CONFLICT(id) DO UPDATE SET last_seen_ts=excluded.last_seen_ts "
+    "RETURNING first_seen_ts = last_seen_ts AS is_new"
+)
+
 def ensure_member_and_seed(conn: sqlite3.Connection, member_id: str) -> None:
     """Ensure that ``member_id`` exists and generate mock purchases if new."""
-    now = int(time.time())
-    cur = conn.execute("SELECT id FROM members WHERE id=?", (member_id,))
-    row = cur.fetchone()
+    ensure_members_and_seed_batch(conn, [member_id])
 
-    if row is None:
-        conn.execute(
-            "INSERT INTO members(id, first_seen_ts, last_seen_ts) VALUES(?,?,?)",
-            (member_id, now, now),
-        )
-        base = now
-        for i in range(5):
-            ts = base - (i + 1) * random.randint(3600, 86400)
-            sku = random.choice(_SKUS)
-            amt = random.randint(1, 3)
-            conn.execute(
+def ensure_members_and_seed_batch(
+    conn: sqlite3.Connection, member_ids: list[str]
+) -> None:
+    """Upsert a batch of members in one transaction, seeding purchases for
+    any that are new."""
+    now = int(time.time())
+    with conn:
+        rows: list[tuple[str, int, str, int]] = []
+        for member_id in member_ids:
+            # Single round-trip upsert: a brand-new member has identical
+            # first/last timestamps, which the RETURNING expression reports.
+            cur = conn.execute(_UPSERT_MEMBER_SQL, (member_id, now, now))
+            if cur.fetchone()[0]:
+                rows.extend(
+                    (
+                        member_id,
+                        now - (i + 1) * random.randint(3600, 86400),
+                        random.choice(_SKUS),
+                        random.randint(1, 3),
+                    )
+                    for i in range(5)
+                )
+        if rows:
+            conn.executemany(
                 "INSERT INTO purchases(id, ts, sku, amount) VALUES(?,?,?,?)",
-                (member_id, ts, sku, amt),
+                rows,
             )
-        conn.commit()
-    else:
-        conn.execute(
-            "UPDATE members SET last_seen_ts=? WHERE id=?",
-            (now, member_id),
-        )
-        conn.commit()
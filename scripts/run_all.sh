@@ -7,6 +7,7 @@ pip install --upgrade pip
 pip install -r requirements.txt
 
 nohup .venv/bin/python camera_loop.py > cam.log 2>&1 &
-nohup .venv/bin/python app.py > web.log 2>&1 &
+nohup .venv/bin/gunicorn -k gthread --threads 8 -w 1 \
+  -b "${HOST:-0.0.0.0}:${PORT:-8000}" wsgi:app > web.log 2>&1 &
 
 echo "running. open http://raspberrypi.local:8000/"
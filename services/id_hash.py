@@ -2,12 +2,71 @@
 from __future__ import annotations
 
 import hashlib
-import hmac
-import json
-from typing import Iterable
-
-def stable_id(embedding: Iterable[float], salt: str) -> str:
-    """Return a deterministic HMAC digest for the given face embedding."""
-    payload = json.dumps(list(embedding), separators=(",", ":"))
-    mac = hmac.new(salt.encode("utf-8"), payload.encode("utf-8"), hashlib.sha256)
+
+import numpy as np
+
+# Numba is optional: when installed, multi-face batches are quantised by a
+# compiled kernel instead of the NumPy expression. np.rint matches np.round's
+# half-to-even behaviour, so both paths produce identical digests.
+_quantize_batch = None
+try:
+    from numba import njit
+except ImportError:
+    pass
+else:
+    @njit(cache=True)
+    def _quantize_batch(encs):  # pragma: no cover - exercised only with numba
+        out = np.empty(encs.shape, np.int16)
+        for i in range(encs.shape[0]):
+            for j in range(encs.shape[1]):
+                out[i, j] = np.int16(np.rint(encs[i, j] * 1000.0))
+        return out
+
+
+# Keyed-hash prototypes cached per salt: initialising a keyed blake2b redoes
+# the key block every call, while .copy() of a prepared prototype is cheap.
+_proto_cache: dict[str, "hashlib.blake2b"] = {}
+
+
+def _get_proto(salt: str):
+    proto = _proto_cache.get(salt)
+    if proto is None:
+        proto = _proto_cache[salt] = hashlib.blake2b(
+            key=salt.encode("utf-8"), digest_size=32
+        )
+    return proto
+
+
+def stable_id(embedding, salt: str) -> str:
+    """Return a deterministic keyed BLAKE2b digest for the given face embedding.
+
+    The embedding is quantised to int16 (three decimal places) before hashing,
+    so small float noise maps to the same identifier and the payload is a
+    compact binary buffer instead of a JSON string. Callers that already hold
+    int16-quantised arrays are hashed as-is without requantising.
+    """
+    arr = np.asarray(embedding)
+    q = arr if arr.dtype == np.int16 else np.round(arr * 1000).astype(np.int16)
+    mac = _get_proto(salt).copy()
+    mac.update(q.tobytes())
     return mac.hexdigest()
+
+
+def stable_ids(embeddings, salt: str) -> list[str]:
+    """Return digests for a batch of embeddings, quantising in one pass."""
+    arr = np.asarray(embeddings)
+    if arr.dtype == np.int16:
+        q = arr
+    else:
+        arr = arr.astype(np.float64, copy=False)
+        if _quantize_batch is not None and arr.ndim == 2 and arr.shape[0] > 1:
+            q = _quantize_batch(arr)
+        else:
+            q = np.round(arr * 1000).astype(np.int16)
+    proto = _get_proto(salt)
+    digests = []
+    for row in q:
+        mac = proto.copy()
+        mac.update(row.tobytes())
+        digests.append(mac.hexdigest())
+    return digests
@@ -0,0 +1,39 @@
+"""Share the most recent member sighting between the camera and web processes.
+
+The camera loop and the Flask app run as separate processes (see
+``scripts/run_all.sh``), so the display's ``/latest`` polling went through
+SQLite on every hit. Publishing the newest member_id to a small file on
+tmpfs turns the common poll into a single tiny read, with the database as
+fallback.
+"""
+from __future__ import annotations
+
+import os
+import tempfile
+
+_DEFAULT_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else "./data"
+LATEST_ID_PATH = os.getenv(
+    "LATEST_ID_PATH", os.path.join(_DEFAULT_DIR, "smart_ad_latest_id")
+)
+
+
+def publish(member_id: str) -> None:
+    """Atomically write ``member_id`` as the latest sighting."""
+    directory = os.path.dirname(LATEST_ID_PATH) or "."
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".latest_id.")
+    try:
+        os.write(fd, member_id.encode("utf-8"))
+    finally:
+        os.close(fd)
+    os.replace(tmp, LATEST_ID_PATH)
+
+
+def read() -> str | None:
+    """Return the latest published member_id, or ``None`` if absent."""
+    try:
+        with open(LATEST_ID_PATH, "rb") as fh:
+            data = fh.read()
+    except OSError:
+        return None
+    member_id = data.decode("utf-8").strip()
+    return member_id or None
@@ -0,0 +1,4 @@
+"""WSGI entry point for gunicorn (see ``scripts/run_all.sh``)."""
+from app import app
+
+__all__ = ["app"]